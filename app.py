@@ -1,19 +1,42 @@
+import io
 import os
+import re
 import json
+import math
+import pickle
+import queue
+import atexit
+import hashlib
+import importlib.util
 import logging
+import logging.handlers
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import numpy as np
 import faiss
+import torch
 from datetime import datetime
-from typing import List, Dict, Any
+from string import Formatter
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Callable
 
-from groq import Groq
+import httpx
+from groq import Groq, AsyncGroq
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.prompts import PromptTemplate
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.schema import Document
-from rank_bm25 import BM25Okapi
+import bm25s
+from sentence_transformers import SentenceTransformer, CrossEncoder
+
+try:
+    from kiru import Chunker  # Optional Rust chunker (much faster on large corpora)
+except ImportError:
+    Chunker = None
+
+# Optional: numba lets bm25s JIT-compile BM25 scoring + top-k. Only check that
+# it is installed; bm25s imports it itself when building the index.
+BM25_BACKEND = "numba" if importlib.util.find_spec("numba") is not None else "numpy"
 # ADD THESE TWO LINES HERE:
 from dotenv import load_dotenv
 load_dotenv()  # This loads your .env file
@@ -23,20 +46,60 @@ print(f"API Key loaded: {os.getenv('GROQ_API_KEY')[:10]}...")
 # CONFIGURATION
 # =============================================================================
 POLICY_DIR = "policies"
+CACHE_DIR = ".rag_cache"
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 100
 TOP_K = 8
 RERANK_K = 3
 HYBRID_ALPHA = 0.7  # 70% semantic, 30% keyword
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = 64
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_BATCH_SIZE = 16
+QUERY_CACHE_SIZE = 1024        # Distinct query embeddings kept in memory
+LLM_MODEL = "llama-3.3-70b-versatile"
+LLM_TIMEOUT = 60.0             # Seconds per LLM request
+LLM_MAX_KEEPALIVE = 32         # Idle connections kept open to the LLM API
+
+# FAISS index selection
+HNSW_M = 32                    # Graph neighbours per node
+HNSW_EF_CONSTRUCTION = 80      # Build-time search depth
+HNSW_EF_SEARCH = 64            # Query-time search depth
+IVF_PQ_THRESHOLD = 10_000      # Switch from HNSW to IVF-PQ above this many chunks
+IVF_NPROBE = 16                # Inverted lists scanned per query
+RECALL_SAMPLE = 32             # Chunks used as probe queries for the recall spot-check
+
+# Bump when tokenize/_STOPWORDS or score fusion change, so results cached
+# from the old retrieval logic are not reused
+RETRIEVAL_VERSION = 1
 
 # =============================================================================
 # LOGGING SETUP
 # =============================================================================
-logging.basicConfig(
-    filename="rag_trace.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+def setup_logging(log_file: str = "rag_trace.log") -> None:
+    """
+    Send log records through an in-memory queue.
+    
+    Callers only enqueue; a background listener thread does the file
+    writes, so retrieval and LLM calls never wait on disk I/O.
+    """
+    root = logging.getLogger()
+    if any(isinstance(h, logging.handlers.QueueHandler) for h in root.handlers):
+        return  # Already set up (Streamlit re-executes this module on rerun)
+    
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    
+    log_queue = queue.Queue(-1)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)  # Flush pending records on exit
+
+setup_logging()
 
 def log_retrieval(query: str, results: List[Dict], prompt_version: str):
     """Log retrieval results for monitoring"""
@@ -78,6 +141,7 @@ with st.sidebar:
     **Models:**
     - LLM: `llama-3.3-70b-versatile` (Groq)
     - Embeddings: `all-MiniLM-L6-v2` (Local)
+    - Reranker: `ms-marco-MiniLM-L-6-v2` (Local)
     """)
     
     if st.button("🔄 Clear Cache & Reload"):
@@ -100,31 +164,40 @@ def load_documents(folder: str) -> List[Document]:
         return []
     
     docs = []
-    files = [f for f in os.listdir(folder) if f.endswith((".pdf", ".txt"))]
+    files = sorted(f for f in os.listdir(folder) if f.endswith((".pdf", ".txt")))
     
     if not files:
         st.warning(f"⚠️ No PDF/TXT files found in '{folder}'. Please add policy documents.")
         return []
     
-    for file in files:
-        try:
-            filepath = os.path.join(folder, file)
-            if file.endswith(".pdf"):
-                loader = PyPDFLoader(filepath)
-            else:
-                loader = TextLoader(filepath)
-            
-            pages = loader.load()
-            for p in pages:
-                p.metadata["source"] = file
-            docs.extend(pages)
-            logging.info(f"✅ Loaded: {file} ({len(pages)} pages)")
-        except Exception as e:
-            st.error(f"❌ Error loading {file}: {e}")
-            logging.error(f"Failed to load {file}: {e}")
+    # Files are independent, so parse them concurrently. Results are
+    # collected in sorted file order to keep chunk ids stable across runs.
+    with ThreadPoolExecutor(max_workers=min(8, len(files))) as executor:
+        futures = [(file, executor.submit(_load_one, folder, file)) for file in files]
+        for file, future in futures:
+            try:
+                pages = future.result()
+                docs.extend(pages)
+                logging.info(f"✅ Loaded: {file} ({len(pages)} pages)")
+            except Exception as e:
+                st.error(f"❌ Error loading {file}: {e}")
+                logging.error(f"Failed to load {file}: {e}")
     
     return docs
 
+def _load_one(folder: str, file: str) -> List[Document]:
+    """Load a single PDF/TXT file (runs in a worker thread, no Streamlit calls)"""
+    filepath = os.path.join(folder, file)
+    if file.endswith(".pdf"):
+        loader = PyPDFLoader(filepath)
+    else:
+        loader = TextLoader(filepath)
+    
+    pages = loader.load()
+    for p in pages:
+        p.metadata["source"] = file
+    return pages
+
 # =============================================================================
 # SMART CHUNKING WITH EXPLANATION
 # =============================================================================
@@ -150,9 +223,41 @@ def chunk_documents(documents: List[Document]) -> List[Document]:
     - Only splits sentences as a fallback
     - Preserves semantic coherence of policy statements
     
+    If the optional `kiru` package is installed, pages are chunked by the
+    Rust character chunker instead (same size/overlap, streaming, but
+    without the separator hierarchy).
+    
     Returns:
         List of chunked Document objects with metadata
     """
+    if Chunker is not None:
+        chunks = _chunk_with_kiru(documents)
+    else:
+        chunks = _chunk_with_langchain(documents)
+    
+    # Add metadata for monitoring
+    for i, chunk in enumerate(chunks):
+        md = chunk.metadata
+        cc = len(chunk.page_content)
+        md["chunk_id"] = i
+        md["char_count"] = cc
+        md["token_estimate"] = cc >> 2  # ~4 chars per token
+    
+    logging.info(f"📦 Created {len(chunks)} chunks from {len(documents)} documents")
+    
+    return chunks
+
+def _chunk_with_kiru(documents: List[Document]) -> List[Document]:
+    """Split each page with the Rust chunker, keeping the page metadata"""
+    chunker = Chunker.by_characters(chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+    return [
+        Document(page_content=text, metadata=dict(doc.metadata))
+        for doc in documents
+        for text in chunker.on_string(doc.page_content).all()
+    ]
+
+def _chunk_with_langchain(documents: List[Document]) -> List[Document]:
+    """Split documents with the hierarchical separator splitter"""
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
@@ -168,76 +273,308 @@ def chunk_documents(documents: List[Document]) -> List[Document]:
         length_function=len,
         is_separator_regex=False
     )
+    return splitter.split_documents(documents)
+
+# =============================================================================
+# EMBEDDINGS
+# =============================================================================
+class SentenceEmbedder:
+    """
+    Thin wrapper around a SentenceTransformer model.
     
-    chunks = splitter.split_documents(documents)
+    Encodes whole batches in one forward pass and returns normalized,
+    contiguous float32 arrays that can be handed to FAISS as-is.
     
-    # Add metadata for monitoring
-    for i, chunk in enumerate(chunks):
-        chunk.metadata["chunk_id"] = i
-        chunk.metadata["char_count"] = len(chunk.page_content)
-        chunk.metadata["token_estimate"] = len(chunk.page_content) // 4
+    Query embeddings are memoized per instance, so Streamlit reruns and
+    repeated evaluation questions skip the model entirely.
+    """
     
-    logging.info(f"📦 Created {len(chunks)} chunks from {len(documents)} documents")
+    def __init__(self, model_name: str = EMBEDDING_MODEL, device: str = "cpu"):
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device=device)
+        self.encode_query = lru_cache(maxsize=QUERY_CACHE_SIZE)(self._encode_query)
     
-    return chunks
+    def encode(self, texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+        """Encode a list of texts into an (n, dim) float32 matrix"""
+        return self.model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+    
+    def _encode_query(self, text: str) -> np.ndarray:
+        """Encode a single query into a read-only (dim,) float32 vector"""
+        vec = self.encode([text], batch_size=1)[0]
+        vec.flags.writeable = False  # Shared between cache hits
+        return vec
+
+@st.cache_resource
+def get_embedder() -> SentenceEmbedder:
+    """Load the embedding model once per process"""
+    return SentenceEmbedder(EMBEDDING_MODEL, device=DEVICE)
+
+@st.cache_resource
+def get_reranker() -> CrossEncoder:
+    """Load the cross-encoder reranker once per process"""
+    return CrossEncoder(RERANKER_MODEL, device=DEVICE)
 
 # =============================================================================
 # FAISS INDEX CREATION
 # =============================================================================
-def build_faiss_index(chunks: List[Document], embedder: HuggingFaceEmbeddings) -> faiss.Index:
+def build_faiss_index(chunks: List[Document], embedder: SentenceEmbedder) -> faiss.Index:
     """
     Build FAISS vector store for semantic search.
     
+    Embeddings are L2-normalized, so inner product == cosine similarity.
+    
+    INDEX SELECTION:
+    ----------------
+    - < 10k chunks: HNSW graph over 8-bit scalar-quantized vectors
+      (sub-linear search, 1 byte per dimension instead of 4)
+    - >= 10k chunks: IVF + PQ (coarse clustering + 16-byte codes per vector)
+    
+    Both quantizers are trained on the corpus itself.
+    
     Args:
         chunks: List of document chunks
-        embedder: HuggingFace embeddings model
+        embedder: Sentence embedding model
         
     Returns:
         FAISS index for similarity search
     """
     with st.spinner("🔄 Building FAISS index..."):
-        vectors = embedder.embed_documents([c.page_content for c in chunks])
-        dim = len(vectors[0])
+        vectors = embedder.encode([c.page_content for c in chunks])
+        n, dim = vectors.shape
         
-        # Using L2 distance (can also use IndexFlatIP for cosine similarity)
-        index = faiss.IndexFlatL2(dim)
-        index.add(np.array(vectors).astype("float32"))
+        if n < IVF_PQ_THRESHOLD:
+            index = faiss.IndexHNSWSQ(
+                dim, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+            )
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        else:
+            nlist = int(4 * math.sqrt(n))
+            index = faiss.index_factory(dim, f"IVF{nlist},PQ16x8", faiss.METRIC_INNER_PRODUCT)
+        
+        index.train(vectors)
+        configure_faiss_search(index)
+        index.add(vectors)
         
-        logging.info(f"🔍 FAISS index created: {index.ntotal} vectors, dimension {dim}")
+        logging.info(f"🔍 FAISS index created: {index.ntotal} vectors, dimension {dim} ({type(index).__name__})")
+        log_index_recall(index, vectors)
     
     return index
 
+def log_index_recall(index: faiss.Index, vectors: np.ndarray, k: int = TOP_K) -> float:
+    """
+    Spot-check what the quantized/approximate index costs in accuracy.
+    
+    A few chunk embeddings are used as queries; recall@k is the share
+    of the exact (brute-force inner product) top-k the index returns.
+    """
+    n = vectors.shape[0]
+    k = min(k, n)
+    sample = vectors[np.random.default_rng(0).choice(n, size=min(RECALL_SAMPLE, n), replace=False)]
+    
+    exact = np.argpartition(-(sample @ vectors.T), k - 1, axis=1)[:, :k]
+    _, approx = index.search(sample, k)
+    
+    hits = sum(len(np.intersect1d(e, a)) for e, a in zip(exact, approx))
+    recall = hits / exact.size
+    logging.info(f"🎯 FAISS recall@{k} vs exact search: {recall:.3f} ({len(sample)} probe queries)")
+    return recall
+
+def configure_faiss_search(index: faiss.Index) -> None:
+    """Apply query-time search parameters (not all of them survive serialization)"""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = IVF_NPROBE
+
+@st.cache_resource
+def get_gpu_resources() -> "faiss.StandardGpuResources":
+    """GPU scratch memory for FAISS, shared by every GPU index in the process"""
+    return faiss.StandardGpuResources()
+
+def faiss_index_to_gpu(index: faiss.Index) -> faiss.Index:
+    """
+    Move an index to GPU 0 when faiss-gpu and a CUDA device are available.
+    
+    Only IVF indexes are moved (FAISS has no GPU HNSW); anything else,
+    or any failure, keeps the CPU index.
+    """
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return index
+    if faiss.try_extract_index_ivf(index) is None:
+        return index
+    
+    try:
+        gpu_index = faiss.index_cpu_to_gpu(get_gpu_resources(), 0, index)
+        logging.info("🚀 FAISS index moved to GPU")
+        return gpu_index
+    except Exception as e:
+        logging.warning(f"⚠️ Keeping FAISS index on CPU: {e}")
+        return index
+
+# =============================================================================
+# INDEX PERSISTENCE (DISK CACHE)
+# =============================================================================
+def index_cache_key(folder: str) -> str:
+    """
+    Fingerprint of everything that affects the chunks and FAISS index:
+    policy files (name + mtime), chunking parameters, embedding model
+    and index construction settings.
+    """
+    files = sorted(f for f in os.listdir(folder) if f.endswith((".pdf", ".txt")))
+    payload = {
+        "files": [(f, os.path.getmtime(os.path.join(folder, f))) for f in files],
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunker": "kiru" if Chunker is not None else "recursive",
+        "model": EMBEDDING_MODEL,
+        "index": ["HNSW-SQ8", HNSW_M, HNSW_EF_CONSTRUCTION, "IVF-PQ16", IVF_PQ_THRESHOLD],
+    }
+    return hashlib.sha1(json.dumps(payload).encode()).hexdigest()
+
+def load_index_cache(key: str) -> Optional[Tuple[List[Document], faiss.Index]]:
+    """Load chunks and FAISS index saved under `key`, or None on a miss"""
+    index_path = os.path.join(CACHE_DIR, f"{key}.faiss")
+    chunks_path = os.path.join(CACHE_DIR, f"{key}.pkl")
+    if not (os.path.exists(index_path) and os.path.exists(chunks_path)):
+        return None
+    
+    try:
+        index = faiss.read_index(index_path)
+        with open(chunks_path, "rb") as f:
+            chunks = pickle.load(f)
+    except Exception as e:
+        logging.warning(f"⚠️ Ignoring unreadable index cache {key}: {e}")
+        return None
+    
+    configure_faiss_search(index)
+    logging.info(f"💾 Loaded index cache {key}: {index.ntotal} vectors")
+    return chunks, index
+
+def save_index_cache(key: str, chunks: List[Document], index: faiss.Index) -> None:
+    """Persist chunks and FAISS index under `key`"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        index_path = os.path.join(CACHE_DIR, f"{key}.faiss")
+        chunks_path = os.path.join(CACHE_DIR, f"{key}.pkl")
+        
+        # Write to temp files first so a crash never leaves a half-written pair
+        faiss.write_index(index, index_path + ".tmp")
+        with open(chunks_path + ".tmp", "wb") as f:
+            pickle.dump(chunks, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(chunks_path + ".tmp", chunks_path)
+        os.replace(index_path + ".tmp", index_path)
+        logging.info(f"💾 Saved index cache {key}")
+    except Exception as e:
+        logging.warning(f"⚠️ Could not save index cache: {e}")
+
 # =============================================================================
 # BM25 INDEX CREATION
 # =============================================================================
-def build_bm25_index(chunks: List[Document]) -> BM25Okapi:
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(bm25s.stopwords.STOPWORDS_EN)
+
+def tokenize(text: str, is_lower: bool = False) -> List[str]:
+    """
+    Lowercase alphanumeric tokens without stopwords.
+    
+    Punctuation never sticks to a token ("refund." == "refund"), and
+    single characters such as "7" in "7 days" are kept. Pass
+    is_lower=True for text that is already lowercased.
+    """
+    if not is_lower:
+        text = text.lower()
+    return [t for t in _TOKEN_RE.findall(text) if t not in _STOPWORDS]
+
+def build_bm25_index(
+    chunks: List[Document],
+    lowered_texts: Optional[List[str]] = None
+) -> bm25s.BM25:
     """
     Build BM25 index for keyword-based search.
     
     BM25 is excellent for exact term matching in policy documents
     where specific keywords matter ("14-day", "refund", "cancellation").
     
+    bm25s precomputes per-token scores into a sparse matrix, so a query
+    is a sparse lookup instead of a Python loop over every document.
+    With numba installed, scoring and top-k selection run as compiled
+    kernels (cached after the first call).
+    
     Args:
         chunks: List of document chunks
+        lowered_texts: Chunk texts already lowercased (optional, saves a pass)
         
     Returns:
         BM25 index
     """
-    tokenized_chunks = [chunk.page_content.lower().split() for chunk in chunks]
-    bm25 = BM25Okapi(tokenized_chunks)
-    logging.info(f"📚 BM25 index created with {len(tokenized_chunks)} documents")
+    if lowered_texts is None:
+        lowered_texts = [chunk.page_content.lower() for chunk in chunks]
+    tokenized_chunks = [tokenize(text, is_lower=True) for text in lowered_texts]
+    bm25 = bm25s.BM25(backend=BM25_BACKEND)
+    bm25.index(tokenized_chunks, show_progress=False)
+    logging.info(f"📚 BM25 index created with {len(chunks)} documents ({BM25_BACKEND} backend)")
     return bm25
 
+# =============================================================================
+# CHUNK STORE (HOT-PATH LOOKUPS)
+# =============================================================================
+class ChunkStore:
+    """
+    Column-oriented copy of the chunk list for retrieval.
+    
+    Texts and metadata live in parallel arrays indexed by chunk position,
+    so formatting results is plain array indexing instead of attribute
+    and dict lookups on Document objects.
+    
+    Each chunk's lowercased words are also stored once as sorted integer
+    ids (`token_ids`, via `vocab`) for cheap word-overlap checks.
+    """
+    
+    def __init__(
+        self,
+        chunks: List[Document],
+        fingerprint: str = "",
+        lowered_texts: Optional[List[str]] = None
+    ):
+        self.fingerprint = fingerprint  # Index cache key of the corpus these chunks came from
+        self.texts = [c.page_content for c in chunks]
+        self.sources = np.array([c.metadata.get("source", "unknown") for c in chunks], dtype=object)
+        self.pages = np.array([c.metadata.get("page", -1) for c in chunks], dtype=np.int32)
+        self.chunk_ids = np.array([c.metadata["chunk_id"] for c in chunks], dtype=np.int32)
+        self.char_counts = np.array([c.metadata.get("char_count", 0) for c in chunks], dtype=np.int32)
+        
+        if lowered_texts is None:
+            lowered_texts = [text.lower() for text in self.texts]
+        
+        self.vocab: Dict[str, int] = {}
+        self.token_ids: List[np.ndarray] = []
+        for text in lowered_texts:
+            ids = {self.vocab.setdefault(w, len(self.vocab)) for w in text.split()}
+            self.token_ids.append(np.array(sorted(ids), dtype=np.uint32))
+    
+    def __len__(self) -> int:
+        return len(self.texts)
+
 # =============================================================================
 # HYBRID RETRIEVAL (SEMANTIC + KEYWORD)
 # =============================================================================
 def hybrid_retrieve(
     query: str,
-    chunks: List[Document],
+    store: ChunkStore,
     faiss_index: faiss.Index,
-    bm25_index: BM25Okapi,
-    embedder: HuggingFaceEmbeddings,
-    alpha: float = HYBRID_ALPHA
+    bm25_index: bm25s.BM25,
+    embedder: SentenceEmbedder,
+    alpha: float = HYBRID_ALPHA,
+    reranker: Optional[CrossEncoder] = None,
+    query_vec: Optional[np.ndarray] = None
 ) -> List[Dict[str, Any]]:
     """
     Hybrid retrieval combining semantic (FAISS) and keyword (BM25) search.
@@ -257,73 +594,115 @@ def hybrid_retrieve(
        - alpha = 0.7 means 70% semantic, 30% keyword
        - This ratio works well for policy docs
     
+    4. Optional cross-encoder rerank:
+       - The best TOP_K*2 fused candidates are rescored as (query, chunk)
+         pairs in one batched forward pass
+       - Final RERANK_K chunks are ordered by the cross-encoder score
+    
     Args:
         query: User question
-        chunks: Document chunks
+        store: Chunk texts and metadata
         faiss_index: FAISS vector index
         bm25_index: BM25 keyword index
         embedder: Embeddings model
         alpha: Weight for semantic vs keyword (default 0.7)
+        reranker: Cross-encoder for second-stage reranking (optional)
+        query_vec: Precomputed query embedding, e.g. from a batched
+            embedder.encode over many questions (optional)
         
     Returns:
         List of retrieved chunks with scores and metadata
     """
     
     # 1. SEMANTIC RETRIEVAL (FAISS)
-    q_vec = embedder.embed_query(query)
+    q_vec = query_vec if query_vec is not None else embedder.encode_query(query)
     semantic_distances, semantic_indices = faiss_index.search(
-        np.array([q_vec]).astype("float32"),
-        min(TOP_K * 2, len(chunks))  # Get more candidates
+        np.ascontiguousarray(q_vec[None, :], dtype=np.float32),  # (1, dim) view, no copy
+        min(TOP_K * 2, len(store))  # Get more candidates
     )
     
-    # Normalize L2 distances to similarity scores (0-1)
-    max_dist = np.max(semantic_distances[0]) if len(semantic_distances[0]) > 0 else 1
-    semantic_scores = 1 - (semantic_distances[0] / (max_dist + 1e-6))
+    # Inner product of normalized vectors is cosine similarity (-1..1);
+    # shift to 0-1 and apply the semantic weight in place
+    valid = semantic_indices[0] >= 0  # FAISS pads missing hits with -1
+    semantic_ids = semantic_indices[0][valid]
+    semantic_scores = semantic_distances[0][valid]
+    np.add(semantic_scores, 1.0, out=semantic_scores)
+    np.multiply(semantic_scores, 0.5 * alpha, out=semantic_scores)
     
-    # 2. KEYWORD RETRIEVAL (BM25)
-    query_tokens = query.lower().split()
-    keyword_scores = bm25_index.get_scores(query_tokens)
+    # 2. KEYWORD RETRIEVAL (BM25, top candidates only)
+    query_tokens = tokenize(query)
+    if query_tokens:
+        bm25_indices, bm25_scores = bm25_index.retrieve(
+            [query_tokens],
+            k=min(TOP_K * 2, len(store)),
+            show_progress=False
+        )
+        keyword_ids = bm25_indices[0]
+        keyword_scores = bm25_scores[0]
+    else:
+        # Stopword/punctuation-only or non-Latin query: bm25s rejects an
+        # empty token list, and no keyword can match anyway
+        keyword_ids = np.empty(0, dtype=np.int64)
+        keyword_scores = np.empty(0, dtype=np.float32)
     
-    # Normalize BM25 scores to 0-1 range
-    max_bm25 = np.max(keyword_scores) if np.max(keyword_scores) > 0 else 1
-    keyword_scores = keyword_scores / (max_bm25 + 1e-6)
+    # Normalize BM25 scores to 0-1 range and apply the keyword weight in one pass
+    max_bm25 = keyword_scores.max() if keyword_scores.size else 0
+    if max_bm25 <= 0:
+        max_bm25 = 1
+    np.multiply(keyword_scores, (1 - alpha) / (max_bm25 + 1e-6), out=keyword_scores)
     
-    # 3. COMBINE SCORES
-    combined_scores = {}
+    # 3. COMBINE SCORES (only over the union of both candidate sets;
+    #    a chunk missing from one retriever scores 0 for that half)
+    candidates = np.union1d(semantic_ids, keyword_ids)
+    combined = np.zeros(candidates.size, dtype=np.float32)
+    combined[np.searchsorted(candidates, semantic_ids)] += semantic_scores
+    combined[np.searchsorted(candidates, keyword_ids)] += keyword_scores
     
-    # Add semantic scores
-    for idx, score in zip(semantic_indices[0], semantic_scores):
-        combined_scores[int(idx)] = alpha * float(score)
+    # 4. FIRST STAGE: keep the best fused candidates (partial sort)
+    n_first = min(TOP_K * 2 if reranker is not None else RERANK_K, combined.size)
+    first = np.argpartition(-combined, n_first - 1)[:n_first]
+    first_ids = candidates[first]
+    scores = combined[first]
     
-    # Add keyword scores
-    for idx, score in enumerate(keyword_scores):
-        if idx in combined_scores:
-            combined_scores[idx] += (1 - alpha) * float(score)
-        else:
-            combined_scores[idx] = (1 - alpha) * float(score)
+    # 5. RERANK (cross-encoder, one batched forward pass)
+    if reranker is not None:
+        pairs = [(query, store.texts[i]) for i in first_ids]
+        scores = reranker.predict(pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)
     
-    # 4. RANK AND SELECT TOP-K
-    top_indices = sorted(
-        combined_scores.items(),
-        key=lambda x: x[1],
-        reverse=True
-    )[:RERANK_K]
+    k = min(RERANK_K, first_ids.size)
+    order = np.argsort(-scores)[:k]
+    top_ids = first_ids[order]
     
-    # 5. FORMAT RESULTS
+    # 6. FORMAT RESULTS
     results = []
-    for idx, score in top_indices:
-        chunk = chunks[idx]
+    for idx, score, page in zip(top_ids, scores[order], store.pages[top_ids]):
         results.append({
-            "chunk_id": chunk.metadata["chunk_id"],
-            "source": chunk.metadata.get("source", "unknown"),
-            "page": chunk.metadata.get("page", "N/A"),
-            "score": round(score, 4),
-            "text": chunk.page_content,
-            "char_count": chunk.metadata.get("char_count", 0)
+            "chunk_id": int(store.chunk_ids[idx]),
+            "source": store.sources[idx],
+            "page": int(page) if page >= 0 else "N/A",
+            "score": round(float(score), 4),
+            "text": store.texts[idx],
+            "char_count": int(store.char_counts[idx])
         })
     
     return results
 
+def build_context(retrieved: List[Dict[str, Any]]) -> str:
+    """
+    Join retrieved chunks into the prompt context, each tagged with its source.
+    
+    Written into one buffer, without an intermediate string per chunk.
+    """
+    buf = io.StringIO()
+    for i, r in enumerate(retrieved):
+        if i:
+            buf.write("\n\n")
+        buf.write("[Source: ")
+        buf.write(r['source'])
+        buf.write("]\n")
+        buf.write(r['text'])
+    return buf.getvalue()
+
 # =============================================================================
 # PROMPT TEMPLATES (V1 & V2)
 # =============================================================================
@@ -372,10 +751,62 @@ JSON Response:
 """
 )
 
+def compile_prompt(template: PromptTemplate) -> Callable[[str, str], str]:
+    """
+    Pre-parse a {context}/{question} template into a render function.
+    
+    The template is split into literal text and fields once, here, so
+    rendering is a single join instead of a full .format() per call.
+    Escaped braces ({{ }}) come out exactly as .format() would emit them.
+    """
+    parts = [(literal, field) for literal, field, _, _ in Formatter().parse(template.template)]
+    
+    def render(context: str, question: str) -> str:
+        values = {"context": context, "question": question}
+        return "".join(
+            literal + values[field] if field is not None else literal
+            for literal, field in parts
+        )
+    
+    return render
+
+RENDER_V1 = compile_prompt(PROMPT_V1)
+RENDER_V2 = compile_prompt(PROMPT_V2)
+
 # =============================================================================
 # LLM INFERENCE (GROQ)
 # =============================================================================
-def call_llm(prompt: str, model: str = "llama-3.3-70b-versatile") -> str:
+@st.cache_resource
+def get_llm_client() -> Optional[Groq]:
+    """
+    Create the Groq client once per process.
+    
+    Reusing the client keeps its HTTP connection pool (and TLS sessions)
+    alive between questions instead of reconnecting on every call. HTTP/2
+    lets concurrent requests share one connection.
+    
+    Returns:
+        Groq client, or None if GROQ_API_KEY is not set
+    """
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        return None
+    
+    http_client = httpx.Client(
+        http2=True,
+        timeout=LLM_TIMEOUT,
+        limits=httpx.Limits(max_keepalive_connections=LLM_MAX_KEEPALIVE)
+    )
+    
+    # Initialize client (compatible with different versions)
+    try:
+        return Groq(api_key=api_key, http_client=http_client)
+    except TypeError:
+        # Fallback for older versions
+        from groq import Client
+        return Client(api_key=api_key)
+
+def call_llm(prompt: str, model: str = LLM_MODEL) -> str:
     """
     Call Groq LLM for inference.
     
@@ -387,19 +818,10 @@ def call_llm(prompt: str, model: str = "llama-3.3-70b-versatile") -> str:
         Model response text
     """
     try:
-        # Get API key
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
+        client = get_llm_client()
+        if client is None:
             return "Error: GROQ_API_KEY not found in environment variables"
         
-        # Initialize client (compatible with different versions)
-        try:
-            client = Groq(api_key=api_key)
-        except TypeError:
-            # Fallback for older versions
-            from groq import Client
-            client = Client(api_key=api_key)
-        
         response = client.chat.completions.create(
             model=model,
             messages=[{"role": "user", "content": prompt}],
@@ -412,6 +834,109 @@ def call_llm(prompt: str, model: str = "llama-3.3-70b-versatile") -> str:
         logging.error(f"❌ LLM call failed: {e}")
         return f"Error calling LLM: {str(e)}"
 
+def call_llm_stream(prompt: str, model: str = LLM_MODEL) -> Iterator[str]:
+    """
+    Call Groq LLM with streaming enabled.
+    
+    Yields text deltas as they arrive, so the UI can render the answer
+    from the first token instead of waiting for the full completion.
+    
+    Args:
+        prompt: Formatted prompt string
+        model: Groq model name
+        
+    Yields:
+        Response text fragments
+    """
+    try:
+        client = get_llm_client()
+        if client is None:
+            yield "Error: GROQ_API_KEY not found in environment variables"
+            return
+        
+        stream = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,  # Deterministic for consistency
+            stream=True
+        )
+        parts = []
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content or ""
+            parts.append(delta)
+            yield delta
+        logging.info(f"🤖 LLM Response: {''.join(parts)[:100]}...")
+    except Exception as e:
+        logging.error(f"❌ LLM call failed: {e}")
+        yield f"Error calling LLM: {str(e)}"
+
+def create_async_llm_client() -> Optional[AsyncGroq]:
+    """
+    Create an async Groq client for concurrent batch calls.
+    
+    Not cached: async connection pools belong to one event loop, so each
+    asyncio.run(...) should create (and close) its own client. Within a
+    run, all requests share one keep-alive HTTP/2 pool.
+    
+    Returns:
+        AsyncGroq client, or None if GROQ_API_KEY is not set
+    """
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        return None
+    http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=LLM_TIMEOUT,
+        limits=httpx.Limits(max_keepalive_connections=LLM_MAX_KEEPALIVE)
+    )
+    return AsyncGroq(api_key=api_key, http_client=http_client)
+
+async def call_llm_async(
+    client: Optional[AsyncGroq],
+    prompt: str,
+    model: str = LLM_MODEL
+) -> str:
+    """
+    Async variant of call_llm, for issuing many requests concurrently.
+    
+    Args:
+        client: Client from create_async_llm_client()
+        prompt: Formatted prompt string
+        model: Groq model name
+        
+    Returns:
+        Model response text
+    """
+    try:
+        if client is None:
+            return "Error: GROQ_API_KEY not found in environment variables"
+        
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0  # Deterministic for consistency
+        )
+        answer = response.choices[0].message.content
+        logging.info(f"🤖 LLM Response: {answer[:100]}...")
+        return answer
+    except Exception as e:
+        logging.error(f"❌ LLM call failed: {e}")
+        return f"Error calling LLM: {str(e)}"
+
+# First ```json ... ``` block in a model response. The opening fence must
+# start a line and the closing one must start or end a line, so "```"
+# inside a JSON string value is left alone. Stops at the first closing
+# fence, dropping any trailing prose (closing fence optional).
+_FENCE_RE = re.compile(
+    r"^[ \t]*```(?:json)?\s*(.*?)\s*(?:^[ \t]*```|```[ \t]*$|\Z)",
+    re.DOTALL | re.MULTILINE
+)
+
+def strip_code_fence(text: str) -> str:
+    """Return the body of a markdown-fenced response, or the stripped text"""
+    m = _FENCE_RE.search(text)
+    return m.group(1) if m else text.strip()
+
 # =============================================================================
 # PIPELINE SETUP (CACHED FOR PERFORMANCE)
 # =============================================================================
@@ -422,40 +947,52 @@ def setup_rag_pipeline():
     Cached to avoid rebuilding on every query.
     
     Returns:
-        Tuple of (chunks, faiss_index, bm25_index, embedder)
+        Tuple of (store, faiss_index, bm25_index, embedder, reranker)
     """
-    # Load documents
-    docs = load_documents(POLICY_DIR)
-    if not docs:
-        return None, None, None, None
+    # Initialize embedder and reranker (local models, loaded once)
+    embedder = get_embedder()
+    reranker = get_reranker()
     
-    # Chunk documents
-    chunks = chunk_documents(docs)
+    # Reuse chunks + FAISS index from disk if the policy files are unchanged
+    cache_key = index_cache_key(POLICY_DIR) if os.path.isdir(POLICY_DIR) else None
+    cached = load_index_cache(cache_key) if cache_key else None
     
-    # Initialize embedder (using local HuggingFace model)
-    embedder = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={'device': 'cpu'},
-        encode_kwargs={'normalize_embeddings': True}
-    )
+    if cached:
+        chunks, faiss_index = cached
+        summary = f"{len(chunks)} chunks (loaded from cache)"
+    else:
+        # Load documents
+        docs = load_documents(POLICY_DIR)
+        if not docs:
+            return None, None, None, None, None
+        
+        # Chunk documents
+        chunks = chunk_documents(docs)
+        
+        faiss_index = build_faiss_index(chunks, embedder)
+        save_index_cache(cache_key, chunks, faiss_index)
+        summary = f"{len(docs)} documents → {len(chunks)} chunks"
     
-    # Build indices
-    faiss_index = build_faiss_index(chunks, embedder)
-    bm25_index = build_bm25_index(chunks)
+    # Cache files always hold the CPU index; move to GPU only afterwards
+    faiss_index = faiss_index_to_gpu(faiss_index)
+    # Lowercase every chunk once; BM25 and the store's token ids share it
+    lowered_texts = [c.page_content.lower() for c in chunks]
+    bm25_index = build_bm25_index(chunks, lowered_texts)
+    store = ChunkStore(chunks, fingerprint=cache_key, lowered_texts=lowered_texts)
     
-    st.success(f"✅ Pipeline ready: {len(docs)} documents → {len(chunks)} chunks")
+    st.success(f"✅ Pipeline ready: {summary}")
     logging.info(f"✅ Pipeline initialized successfully")
     
-    return chunks, faiss_index, bm25_index, embedder
+    return store, faiss_index, bm25_index, embedder, reranker
 
 # =============================================================================
 # MAIN UI
 # =============================================================================
 
 # Initialize pipeline
-chunks, faiss_index, bm25_index, embedder = setup_rag_pipeline()
+store, faiss_index, bm25_index, embedder, reranker = setup_rag_pipeline()
 
-if chunks is None:
+if store is None:
     st.stop()
 
 # Two columns for question input and prompt selection
@@ -495,10 +1032,11 @@ if question:
         # Retrieve chunks
         retrieved = hybrid_retrieve(
             query=question,
-            chunks=chunks,
+            store=store,
             faiss_index=faiss_index,
             bm25_index=bm25_index,
-            embedder=embedder
+            embedder=embedder,
+            reranker=reranker
         )
         
         # Log retrieval
@@ -521,33 +1059,24 @@ if question:
 """)
             
             # Build context from retrieved chunks
-            context = "\n\n".join([
-                f"[Source: {r['source']}]\n{r['text']}"
-                for r in retrieved
-            ])
+            context = build_context(retrieved)
             
             # Select prompt
-            prompt_template = PROMPT_V1 if "V1" in prompt_choice else PROMPT_V2
-            prompt = prompt_template.format(context=context, question=question)
-            
-            # Call LLM
-            with st.spinner("🤖 Generating answer..."):
-                raw_answer = call_llm(prompt)
+            render_prompt = RENDER_V1 if "V1" in prompt_choice else RENDER_V2
+            prompt = render_prompt(context, question)
             
             # Display answer
             st.subheader("💡 Answer")
             
             # Try JSON parsing for V2
             if "V2" in prompt_choice:
+                # JSON has to be complete before it can be parsed, so no streaming
+                with st.spinner("🤖 Generating answer..."):
+                    raw_answer = call_llm(prompt)
+                
                 try:
                     # Clean response (remove markdown backticks if present)
-                    clean_answer = raw_answer.strip()
-                    if clean_answer.startswith("```json"):
-                        clean_answer = clean_answer.split("```json")[1].split("```")[0].strip()
-                    elif clean_answer.startswith("```"):
-                        clean_answer = clean_answer.split("```")[1].split("```")[0].strip()
-                    
-                    parsed = json.loads(clean_answer)
+                    parsed = json.loads(strip_code_fence(raw_answer))
                     
                     # Display nicely
                     st.markdown(f"**Answer:** {parsed.get('answer', 'N/A')}")
@@ -579,8 +1108,8 @@ if question:
                     st.error(f"Error parsing response: {e}")
                     st.write(raw_answer)
             else:
-                # V1 - just show text
-                st.write(raw_answer)
+                # V1 - plain text, stream it as it is generated
+                raw_answer = st.write_stream(call_llm_stream(prompt))
             
             # Show prompt used
             with st.expander("📝 Prompt Used", expanded=False):
@@ -6,20 +6,60 @@ covering different scenarios: answerable, partially answerable, and unanswerable
 """
 
 import os
+import re
+import csv
+import glob
+import argparse
 import json
+import shelve
+import asyncio
+import hashlib
 import logging
 from datetime import datetime
+from collections import Counter
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
-import pandas as pd
+import numpy as np
+import orjson
+
+try:
+    import ahocorasick  # Optional: pyahocorasick for single-pass keyword scanning
+except ImportError:
+    ahocorasick = None
+
+try:
+    import ollama  # Optional: local models via an Ollama server (--backend ollama)
+except ImportError:
+    ollama = None
 
 from app import (
     setup_rag_pipeline,
     hybrid_retrieve,
+    build_context,
     call_llm,
-    PROMPT_V1,
-    PROMPT_V2
+    CACHE_DIR,
+    TOP_K,
+    RERANK_K,
+    HYBRID_ALPHA,
+    RERANKER_MODEL,
+    HNSW_EF_SEARCH,
+    IVF_NPROBE,
+    RETRIEVAL_VERSION,
+    LLM_MODEL,
+    create_async_llm_client,
+    call_llm_async,
+    strip_code_fence,
+    RENDER_V1,
+    RENDER_V2
 )
 
+LLM_CONCURRENCY = 16  # Max in-flight LLM requests (provider rate limits)
+OLLAMA_MODEL = "llama3.1"
+RETRIEVAL_CACHE = os.path.join(CACHE_DIR, "eval_retrieval")
+LLM_CACHE = os.path.join(CACHE_DIR, "eval_llm")
+BATCH_ANSWER_RE = re.compile(r"\[(\d+)\]\s*(.*?)(?=\n\[\d+\]|\Z)", re.S)
+
 # =============================================================================
 # EVALUATION QUESTION SET
 # =============================================================================
@@ -151,14 +191,333 @@ EVALUATION RUBRIC:
 - Incorrect or misleading information
 """
 
+# =============================================================================
+# PERSISTENT CACHES (RETRIEVAL + LLM ANSWERS)
+# =============================================================================
+
+def _cache_key(*parts) -> str:
+    return hashlib.sha1("\x00".join(str(p) for p in parts).encode()).hexdigest()
+
+def cached_retrieve_all(
+    questions: List[str], store, faiss_index, bm25_index, embedder, reranker,
+    use_cache: bool = True
+) -> List[List[Dict]]:
+    """
+    hybrid_retrieve for many questions, with a disk cache (for re-runs).
+    
+    Keyed by question, corpus fingerprint, query-time search settings and
+    RETRIEVAL_VERSION, so a changed policy file or config value never
+    serves stale chunks. Cache misses are embedded together in one
+    batched encode call. use_cache=False ignores cached results (fresh
+    ones still overwrite them).
+    
+    Returns:
+        Retrieved chunks per question, in the same order as `questions`
+    """
+    keys = [
+        _cache_key(
+            q, store.fingerprint, TOP_K, RERANK_K, HYBRID_ALPHA, RERANKER_MODEL,
+            HNSW_EF_SEARCH, IVF_NPROBE, RETRIEVAL_VERSION
+        )
+        for q in questions
+    ]
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with shelve.open(RETRIEVAL_CACHE) as cache:
+        results = {k: cache[k] for k in keys if k in cache} if use_cache else {}
+        
+        misses = [(k, q) for k, q in zip(keys, questions) if k not in results]
+        if misses:
+            query_vecs = embedder.encode([q for _, q in misses], batch_size=32)
+            for (k, q), q_vec in zip(misses, query_vecs):
+                results[k] = cache[k] = hybrid_retrieve(
+                    query=q,
+                    store=store,
+                    faiss_index=faiss_index,
+                    bm25_index=bm25_index,
+                    embedder=embedder,
+                    reranker=reranker,
+                    query_vec=q_vec
+                )
+    
+    return [results[k] for k in keys]
+
+# =============================================================================
+# CONCURRENT ANSWER GENERATION
+# =============================================================================
+
+def generate_answers(
+    prompts: List[str],
+    concurrency: int = LLM_CONCURRENCY,
+    backend: str = "groq",
+    model: str = LLM_MODEL,
+    use_cache: bool = True
+) -> List[str]:
+    """
+    Send all prompts to the LLM concurrently.
+    
+    Network round-trips overlap instead of running back to back, with at
+    most `concurrency` requests in flight. Uses the async client normally;
+    inside an already running event loop (e.g. Jupyter), where
+    asyncio.run is not allowed, falls back to a thread pool of blocking calls.
+    
+    With backend="ollama" the prompts go to a local Ollama server. There
+    the GPU is the bottleneck, and concurrency only helps up to the
+    server's OLLAMA_NUM_PARALLEL (set where `ollama serve` runs), which
+    lets it batch that many requests in one decode step.
+    
+    Answers already in the disk cache (keyed by model + prompt) are not
+    requested again (unless use_cache=False); failed calls are not cached.
+    
+    Returns:
+        Answers in the same order as `prompts`
+    """
+    if backend == "ollama" and ollama is None:
+        raise RuntimeError("backend 'ollama' needs the ollama package: pip install ollama")
+    
+    keys = [_cache_key(model, p) for p in prompts]
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with shelve.open(LLM_CACHE) as cache:
+        cached = {k: cache[k] for k in keys if k in cache} if use_cache else {}
+    
+    todo = [(k, p) for k, p in zip(keys, prompts) if k not in cached]
+    if todo:
+        todo_prompts = [p for _, p in todo]
+        if _in_event_loop():
+            fresh = _request_answers_threaded(todo_prompts, concurrency, backend, model)
+        else:
+            fresh = asyncio.run(_request_answers(todo_prompts, concurrency, backend, model))
+        with shelve.open(LLM_CACHE) as cache:
+            for (k, _), answer in zip(todo, fresh):
+                cached[k] = answer
+                if not answer.startswith("Error"):
+                    cache[k] = answer
+    
+    return [cached[k] for k in keys]
+
+async def _request_answers(prompts: List[str], concurrency: int, backend: str, model: str) -> List[str]:
+    """Send prompts concurrently, at most `concurrency` in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    if backend == "ollama":
+        client = ollama.AsyncClient()
+        
+        async def _answer(prompt: str) -> str:
+            async with semaphore:
+                return await call_ollama_async(client, prompt, model)
+        
+        try:
+            answers = await asyncio.gather(*(_answer(p) for p in prompts), return_exceptions=True)
+        finally:
+            await close_ollama_client(client)
+    else:
+        client = create_async_llm_client()
+        
+        async def _answer(prompt: str) -> str:
+            async with semaphore:
+                return await call_llm_async(client, prompt, model)
+        
+        try:
+            answers = await asyncio.gather(*(_answer(p) for p in prompts), return_exceptions=True)
+        finally:
+            if client is not None:
+                await client.close()
+    
+    return [a if isinstance(a, str) else f"Error calling LLM: {a}" for a in answers]
+
+async def close_ollama_client(client) -> None:
+    """Close an ollama.AsyncClient (close() only exists from ollama 0.6 on)"""
+    close = getattr(client, "close", None)
+    if close is not None:
+        await close()
+    else:
+        await client._client.aclose()  # Underlying httpx.AsyncClient
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+def _request_answers_threaded(prompts: List[str], concurrency: int, backend: str, model: str) -> List[str]:
+    """Blocking variant on a thread pool (sockets release the GIL)"""
+    call = call_ollama if backend == "ollama" else call_llm
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda p: call(p, model), prompts))
+
+async def call_ollama_async(client, prompt: str, model: str = OLLAMA_MODEL) -> str:
+    """Generate an answer with a local Ollama model (async)"""
+    try:
+        response = await client.generate(model=model, prompt=prompt, options={"temperature": 0})
+        return response["response"]
+    except Exception as e:
+        logging.error(f"❌ Ollama call failed: {e}")
+        return f"Error calling LLM: {str(e)}"
+
+def call_ollama(prompt: str, model: str = OLLAMA_MODEL) -> str:
+    """Generate an answer with a local Ollama model (blocking)"""
+    try:
+        response = ollama.generate(model=model, prompt=prompt, options={"temperature": 0})
+        return response["response"]
+    except Exception as e:
+        logging.error(f"❌ Ollama call failed: {e}")
+        return f"Error calling LLM: {str(e)}"
+
+# =============================================================================
+# BATCH PROMPTING (SEVERAL QUESTIONS PER LLM CALL)
+# =============================================================================
+
+BATCH_PROMPT_V1 = """Answer each numbered question using the context given with it.
+
+{sections}
+
+Reply with one answer per question, in this exact format:
+[1] <answer>
+[2] <answer>
+...
+"""
+
+BATCH_PROMPT_V2 = """You are an expert assistant for company policy documents.
+
+STRICT INSTRUCTIONS:
+1. Answer each numbered question ONLY using the context given with that question
+2. Do NOT use outside knowledge or make assumptions
+3. If the answer is not present or unclear, respond with:
+   "The provided policy documents do not contain sufficient information to answer this question."
+4. Always cite the source document name in your answer
+5. Be precise and quote exact policy terms when relevant
+
+{sections}
+
+Respond with a valid JSON array containing one object per question:
+[
+  {{
+    "index": <question number>,
+    "answer": "<your answer or refusal message>",
+    "source_document": "<policy document name or 'Not specified'>",
+    "confidence": "High | Medium | Low",
+    "reasoning": "<brief explanation of how you arrived at this answer>"
+  }}
+]
+
+JSON Response:
+"""
+
+def build_batch_prompt(prompt_version: str, jobs: List[Dict]) -> str:
+    """Pack several questions (each with its own context) into one prompt"""
+    sections = "\n\n".join(
+        f"[{i}] Question: {job['item']['question']}\nContext:\n{job['context']}"
+        for i, job in enumerate(jobs, 1)
+    )
+    template = BATCH_PROMPT_V1 if prompt_version == "V1" else BATCH_PROMPT_V2
+    return template.format(sections=sections)
+
+def parse_batch_answers(prompt_version: str, completion: str, n: int) -> List[str]:
+    """
+    Split one batched completion back into `n` answers.
+    
+    V2 answers are re-serialized as single JSON objects so they display
+    exactly like unbatched V2 responses. Items without an answer get a
+    short error marker; the raw completion is logged once, not copied
+    into every item.
+    """
+    if completion.startswith("Error"):
+        return [completion] * n  # The LLM call itself failed
+    
+    answers = {}
+    reason = ""
+    if prompt_version == "V2":
+        try:
+            for obj in orjson.loads(strip_code_fence(completion)):
+                idx = int(obj.pop("index"))  # Pop before dumping: drop the key from the answer
+                answers[idx] = orjson.dumps(obj).decode()
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            reason = f" ({type(e).__name__}: {e})"
+    else:
+        for idx, text in BATCH_ANSWER_RE.findall(completion):
+            answers[int(idx)] = text.strip()
+    
+    missing = [i for i in range(1, n + 1) if i not in answers]
+    if missing:
+        logging.warning(
+            f"⚠️ Batched {prompt_version} response has no answer for {missing}{reason}. "
+            f"Raw completion:\n{completion}"
+        )
+    return [
+        answers.get(i, f"Error: no answer [{i}] in batched {prompt_version} response (raw completion in rag_trace.log)")
+        for i in range(1, n + 1)
+    ]
+
+def generate_batched_answers(jobs: List[Dict], batch_size: int, **llm_options) -> List[str]:
+    """
+    Answer jobs `batch_size` questions per LLM call (per prompt version).
+    `llm_options` are passed on to generate_answers.
+    
+    Returns:
+        Answers in the same order as `jobs`
+    """
+    batches = []
+    for version in ("V1", "V2"):
+        ids = [i for i, job in enumerate(jobs) if job["prompt_version"] == version]
+        for start in range(0, len(ids), batch_size):
+            batches.append((version, ids[start:start + batch_size]))
+    
+    prompts = [build_batch_prompt(version, [jobs[i] for i in ids]) for version, ids in batches]
+    completions = generate_answers(prompts, **llm_options)
+    
+    answers = [None] * len(jobs)
+    for (version, ids), completion in zip(batches, completions):
+        for i, answer in zip(ids, parse_batch_answers(version, completion, len(ids))):
+            answers[i] = answer
+    return answers
+
+# =============================================================================
+# RESUME SUPPORT
+# =============================================================================
+
+def latest_results_file() -> str:
+    """Most recent evaluation_results_<ts>.ndjson in the working directory, or ''"""
+    files = sorted(glob.glob("evaluation_results_*.ndjson"))
+    return files[-1] if files else ""
+
+def load_scored(path: str) -> set:
+    """(prompt_version, question_id) pairs already scored in a results file"""
+    with open(path) as f:
+        return {
+            (rec["prompt_version"], rec["question_id"])
+            for rec in map(json.loads, filter(str.strip, f))
+        }
+
 # =============================================================================
 # EVALUATION FUNCTION
 # =============================================================================
 
-def evaluate_rag_system():
+def evaluate_rag_system(
+    batch_size: int = 1,
+    resume: bool = False,
+    concurrency: int = LLM_CONCURRENCY,
+    backend: str = "groq",
+    model: str = "",
+    use_cache: bool = True
+):
     """
     Run comprehensive evaluation of the RAG system.
     Tests both prompt versions against the evaluation question set.
+    
+    All prompts are built and sent to the LLM up front; manual scoring
+    happens afterwards, once every answer is back.
+    
+    Args:
+        batch_size: Questions packed into one LLM call. 1 (default) sends
+            the exact V1/V2 prompts; larger values cut the number of calls
+            but use the batch variants of the templates.
+        resume: Continue the most recent run: questions already scored in
+            its results file are skipped and new scores are appended to it.
+        concurrency: Max LLM requests in flight
+        backend: "groq" (remote API) or "ollama" (local server)
+        model: Model name; defaults to LLM_MODEL / OLLAMA_MODEL per backend
+        use_cache: Reuse cached retrievals and answers from earlier runs;
+            False re-queries retrieval and the LLM
     """
     
     print("="*80)
@@ -169,70 +528,101 @@ def evaluate_rag_system():
     
     # Initialize pipeline
     print("Initializing RAG pipeline...")
-    chunks, faiss_index, bm25_index, embedder = setup_rag_pipeline()
+    store, faiss_index, bm25_index, embedder, reranker = setup_rag_pipeline()
     
-    if chunks is None:
+    if store is None:
         print("❌ Failed to initialize pipeline. Check if policy documents exist.")
         return
     
-    print(f"✅ Pipeline ready with {len(chunks)} chunks\n")
+    print(f"✅ Pipeline ready with {len(store)} chunks\n")
     
-    results = []
+    # Retrieve once per question; both prompt versions share the context
+    retrievals = {}
+    all_retrieved = cached_retrieve_all(
+        [item['question'] for item in EVALUATION_QUESTIONS],
+        store, faiss_index, bm25_index, embedder, reranker,
+        use_cache=use_cache
+    )
+    for item, retrieved in zip(EVALUATION_QUESTIONS, all_retrieved):
+        retrievals[item['id']] = (retrieved, build_context(retrieved))
     
-    # Evaluate both prompt versions
+    # Build prompts for both prompt versions
+    jobs = []
     for prompt_version in ["V1", "V2"]:
-        print(f"\n{'='*80}")
-        print(f"EVALUATING PROMPT {prompt_version}")
-        print(f"{'='*80}\n")
-        
-        prompt_template = PROMPT_V1 if prompt_version == "V1" else PROMPT_V2
+        render_prompt = RENDER_V1 if prompt_version == "V1" else RENDER_V2
         
         for item in EVALUATION_QUESTIONS:
+            retrieved, context = retrievals[item['id']]
+            prompt = render_prompt(context, item['question'])
+            jobs.append({
+                "prompt_version": prompt_version,
+                "item": item,
+                "retrieved": retrieved,
+                "context": context,
+                "prompt": prompt
+            })
+    
+    # Skip anything already scored by the run being resumed
+    stream_file = latest_results_file() if resume else ""
+    if stream_file:
+        done = load_scored(stream_file)
+        jobs = [j for j in jobs if (j["prompt_version"], j["item"]["id"]) not in done]
+        print(f"⏩ Resuming {stream_file}: {len(done)} scored, {len(jobs)} remaining")
+    
+    # Generate all answers concurrently
+    llm_options = {
+        "concurrency": concurrency,
+        "backend": backend,
+        "model": model or (OLLAMA_MODEL if backend == "ollama" else LLM_MODEL),
+        "use_cache": use_cache
+    }
+    print(f"🤖 Generating {len(jobs)} answers with {llm_options['model']} ({backend}, up to {concurrency} in parallel)...")
+    if batch_size > 1:
+        answers = generate_batched_answers(jobs, batch_size, **llm_options)
+    else:
+        answers = generate_answers([job["prompt"] for job in jobs], **llm_options)
+    
+    # One timestamp for every output file of this run (kept when resuming)
+    if stream_file:
+        ts = stream_file[len("evaluation_results_"):-len(".ndjson")]
+    else:
+        ts = datetime.now().strftime('%Y%m%d_%H%M%S')
+        stream_file = f"evaluation_results_{ts}.ndjson"
+    
+    # Results are streamed to a JSON-Lines file as they are scored
+    print(f"📝 Streaming results to: {stream_file}")
+    current_version = None
+    
+    with open(stream_file, "a") as out:
+        # Display and manually score each answer
+        for job, answer in zip(jobs, answers):
+            prompt_version = job["prompt_version"]
+            item = job["item"]
+            retrieved = job["retrieved"]
+            
+            if prompt_version != current_version:
+                current_version = prompt_version
+                print(f"\n{'='*80}")
+                print(f"EVALUATING PROMPT {prompt_version}")
+                print(f"{'='*80}\n")
+            
             print(f"\n[Question {item['id']}] {item['question']}")
             print(f"Category: {item['category']} | Expected: {item['expected_type']}")
             print("-" * 80)
             
-            # Retrieve
-            retrieved = hybrid_retrieve(
-                query=item['question'],
-                chunks=chunks,
-                faiss_index=faiss_index,
-                bm25_index=bm25_index,
-                embedder=embedder
-            )
-            
-            # Build context
-            context = "\n\n".join([
-                f"[Source: {r['source']}]\n{r['text']}"
-                for r in retrieved
-            ])
-            
-            # Generate answer
-            prompt = prompt_template.format(
-                context=context,
-                question=item['question']
-            )
-            answer = call_llm(prompt)
-            
             # Display
             print(f"\n🤖 Answer ({prompt_version}):")
             if prompt_version == "V2":
                 try:
-                    clean_answer = answer.strip()
-                    if clean_answer.startswith("```json"):
-                        clean_answer = clean_answer.split("```json")[1].split("```")[0].strip()
-                    elif clean_answer.startswith("```"):
-                        clean_answer = clean_answer.split("```")[1].split("```")[0].strip()
-                    
-                    parsed = json.loads(clean_answer)
-                    print(json.dumps(parsed, indent=2))
-                except:
+                    parsed = orjson.loads(strip_code_fence(answer))
+                    print(orjson.dumps(parsed, option=orjson.OPT_INDENT_2).decode())
+                except orjson.JSONDecodeError:
                     print(answer)
             else:
                 print(answer)
             
             print(f"\n📊 Retrieved {len(retrieved)} chunks:")
-            for r in retrieved[:3]:  # Show top 3
+            for r in islice(retrieved, 3):  # Show top 3
                 print(f"  - {r['source']} (score: {r['score']})")
             
             # Manual scoring prompt
@@ -240,42 +630,56 @@ def evaluate_rag_system():
             print(f"Score this answer: ✅ (3 pts) | ⚠️ (2 pts) | ❌ (1 pt)")
             score = input("Enter score: ").strip()
             
-            # Record result
-            results.append({
+            # Record result (written immediately so a crash loses nothing)
+            answer_len = len(answer)
+            record = {
                 "prompt_version": prompt_version,
                 "question_id": item['id'],
                 "question": item['question'],
                 "category": item['category'],
                 "expected_type": item['expected_type'],
-                "answer": answer[:200] + "..." if len(answer) > 200 else answer,
+                "answer": answer[:200] + "..." if answer_len > 200 else answer,
                 "num_chunks": len(retrieved),
                 "score": score,
                 "timestamp": datetime.now().isoformat()
-            })
+            }
+            out.write(json.dumps(record) + "\n")
+            out.flush()
     
     # =============================================================================
     # SAVE RESULTS
     # =============================================================================
     
-    # Save to JSON
-    output_file = f"evaluation_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(stream_file) as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    
+    # Save to JSON (same layout as before, rebuilt from the stream file)
+    output_file = f"evaluation_results_{ts}.json"
     with open(output_file, 'w') as f:
         json.dump(results, f, indent=2)
     
     print(f"\n✅ Results saved to: {output_file}")
     
-    # Create summary
-    df = pd.DataFrame(results)
+    # Create summary (prompt version x score cross-tab)
+    counts = Counter((r['prompt_version'], r['score']) for r in results)
+    versions = sorted({v for v, _ in counts})
+    scores = sorted({s for _, s in counts})
     
     print("\n" + "="*80)
     print("EVALUATION SUMMARY")
     print("="*80)
-    print(df.groupby(['prompt_version', 'score']).size().unstack(fill_value=0))
+    print("score".ljust(8) + "".join(str(s).rjust(6) for s in scores))
+    for v in versions:
+        print(v.ljust(8) + "".join(str(counts[(v, s)]).rjust(6) for s in scores))
     
     # Save CSV
-    csv_file = f"evaluation_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    df.to_csv(csv_file, index=False)
-    print(f"\n✅ Summary saved to: {csv_file}")
+    csv_file = f"evaluation_summary_{ts}.csv"
+    if results:
+        with open(csv_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"\n✅ Summary saved to: {csv_file}")
     
     return results
 
@@ -283,29 +687,56 @@ def evaluate_rag_system():
 # AUTOMATED EVALUATION (BONUS)
 # =============================================================================
 
-def auto_evaluate_hallucination(answer: str, context: str) -> Dict:
+# Common hallucination indicators
+HALLUCINATION_KEYWORDS = [
+    "i think", "probably", "might be", "generally", "usually",
+    "in my experience", "typically", "most companies"
+]
+
+# One automaton (or one alternation regex) finds any keyword in a single pass
+if ahocorasick is not None:
+    _KEYWORD_AUTOMATON = ahocorasick.Automaton()
+    for _keyword in HALLUCINATION_KEYWORDS:
+        _KEYWORD_AUTOMATON.add_word(_keyword, _keyword)
+    _KEYWORD_AUTOMATON.make_automaton()
+    
+    def _has_uncertainty_marker(text: str) -> bool:
+        return next(_KEYWORD_AUTOMATON.iter(text), None) is not None
+else:
+    _KEYWORD_RE = re.compile("|".join(map(re.escape, HALLUCINATION_KEYWORDS)))
+    
+    def _has_uncertainty_marker(text: str) -> bool:
+        return _KEYWORD_RE.search(text) is not None
+
+def auto_evaluate_hallucination(answer: str, retrieved: List[Dict], store) -> Dict:
     """
     Simple automated hallucination detection.
     
-    Checks if answer contains information not present in context.
+    Checks if answer contains information not present in the retrieved
+    chunks. Context words come from the token ids precomputed on the
+    ChunkStore, so the context is never re-lowercased or re-split.
     This is a basic heuristic - not perfect but useful for quick checks.
     """
-    # Check for common hallucination indicators
-    hallucination_keywords = [
-        "i think", "probably", "might be", "generally", "usually",
-        "in my experience", "typically", "most companies"
-    ]
-    
     answer_lower = answer.lower()
     
     # Check for keywords
-    has_uncertainty = any(keyword in answer_lower for keyword in hallucination_keywords)
+    has_uncertainty = _has_uncertainty_marker(answer_lower)
     
     # Check if key terms in answer appear in context
     # (Very basic - just checking word overlap)
     answer_words = set(answer_lower.split())
-    context_words = set(context.lower().split())
-    overlap = len(answer_words & context_words) / len(answer_words) if answer_words else 0
+    if answer_words and retrieved:
+        vocab = store.vocab
+        answer_ids = np.fromiter(
+            (vocab[w] for w in answer_words if w in vocab), dtype=np.uint32
+        )
+        context_ids = np.unique(np.concatenate(
+            [store.token_ids[r["chunk_id"]] for r in retrieved]
+        ))
+        shared = np.intersect1d(answer_ids, context_ids, assume_unique=True).size
+        overlap = shared / len(answer_words)
+    else:
+        overlap = 0
     
     return {
         "has_uncertainty_markers": has_uncertainty,
@@ -317,5 +748,48 @@ def auto_evaluate_hallucination(answer: str, context: str) -> Dict:
 # MAIN
 # =============================================================================
 
+def _positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
 if __name__ == "__main__":
-    evaluate_rag_system()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Evaluate the Policy RAG Assistant")
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="continue the latest run, skipping questions that are already scored"
+    )
+    parser.add_argument(
+        "--batch-size", type=_positive_int, default=1,
+        help="questions per LLM call (default: 1, the exact V1/V2 prompts)"
+    )
+    parser.add_argument(
+        "--concurrency", type=_positive_int, default=LLM_CONCURRENCY,
+        help=f"max LLM requests in flight (default: {LLM_CONCURRENCY}); for ollama, "
+             "match the server's OLLAMA_NUM_PARALLEL"
+    )
+    parser.add_argument(
+        "--backend", choices=["groq", "ollama"], default="groq",
+        help="LLM backend: Groq API (default) or a local Ollama server"
+    )
+    parser.add_argument(
+        "--model", default="",
+        help=f"model name (default: {LLM_MODEL} for groq, {OLLAMA_MODEL} for ollama)"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="ignore cached retrievals and LLM answers and query again "
+             "(fresh results still refresh the cache)"
+    )
+    args = parser.parse_args()
+    
+    evaluate_rag_system(
+        batch_size=args.batch_size,
+        resume=args.resume,
+        concurrency=args.concurrency,
+        backend=args.backend,
+        model=args.model,
+        use_cache=not args.no_cache
+    )
\ No newline at end of file